@@ -185,6 +185,9 @@ Use the provided context to ensure accuracy.
         """Initialize the User Story Agent"""
         self.mcp_server_url = self.MCP_SERVER_URL
         
+        # Reuse keep-alive connections to the MCP server across queries
+        self.session = requests.Session()
+        
         # Ensure data directory exists
         os.makedirs(self.DATA_DIR, exist_ok=True)
         
@@ -592,7 +595,7 @@ Use the provided context to ensure accuracy.
     def _query_mcp_rag(self, query: str) -> Optional[Dict[str, Any]]:
         """Query MCP RAG endpoint"""
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.mcp_server_url}{self.MCP_RAG_ENDPOINT}",
                 json={"data": [query]},
                 timeout=60
@@ -603,26 +606,26 @@ Use the provided context to ensure accuracy.
                 event_id = event_data.get("event_id")
                 
                 if event_id:
-                    result_response = requests.get(
+                    with self.session.get(
                         f"{self.mcp_server_url}{self.MCP_RAG_ENDPOINT}/{event_id}",
-                        timeout=60
-                    )
-                    
-                    if result_response.ok:
-                        for line in result_response.iter_lines():
-                            if line:
-                                line_str = line.decode('utf-8')
-                                if line_str.startswith('data:'):
-                                    data = json.loads(line_str[5:].strip())
-                                    if isinstance(data, list) and len(data) > 0:
-                                        result = data[0] if isinstance(data[0], dict) else {}
-                                        if result.get("status") == "success":
-                                            spec = result.get("specification", {})
-                                            return {
-                                                "context": spec.get("full_answer", ""),
-                                                "features": spec.get("features", []),
-                                                "requirements": spec.get("technical_requirements", [])
-                                            }
+                        timeout=60,
+                        stream=True
+                    ) as result_response:
+                        if result_response.ok:
+                            for line in result_response.iter_lines():
+                                if line:
+                                    line_str = line.decode('utf-8')
+                                    if line_str.startswith('data:'):
+                                        data = json.loads(line_str[5:].strip())
+                                        if isinstance(data, list) and len(data) > 0:
+                                            result = data[0] if isinstance(data[0], dict) else {}
+                                            if result.get("status") == "success":
+                                                spec = result.get("specification", {})
+                                                return {
+                                                    "context": spec.get("full_answer", ""),
+                                                    "features": spec.get("features", []),
+                                                    "requirements": spec.get("technical_requirements", [])
+                                                }
         except Exception as e:
             print(f"[{self.PERSONA_NAME}] RAG query error: {e}")
         
@@ -631,7 +634,7 @@ Use the provided context to ensure accuracy.
     def _query_mcp_finetuned(self, query: str, domain: str = "general") -> Optional[Dict[str, Any]]:
         """Query MCP fine-tuned model endpoint"""
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.mcp_server_url}{self.MCP_FINETUNED_ENDPOINT}",
                 json={"data": [query, domain]},
                 timeout=60
@@ -642,26 +645,26 @@ Use the provided context to ensure accuracy.
                 event_id = event_data.get("event_id")
                 
                 if event_id:
-                    result_response = requests.get(
+                    with self.session.get(
                         f"{self.mcp_server_url}{self.MCP_FINETUNED_ENDPOINT}/{event_id}",
-                        timeout=60
-                    )
-                    
-                    if result_response.ok:
-                        for line in result_response.iter_lines():
-                            if line:
-                                line_str = line.decode('utf-8')
-                                if line_str.startswith('data:'):
-                                    data = json.loads(line_str[5:].strip())
-                                    if isinstance(data, list) and len(data) > 0:
-                                        result = data[0] if isinstance(data[0], dict) else {}
-                                        if result.get("status") == "success":
-                                            insights = result.get("insights", {})
-                                            return {
-                                                "context": insights.get("full_response", ""),
-                                                "domain": insights.get("domain", "general"),
-                                                "recommendations": insights.get("recommendations", [])
-                                            }
+                        timeout=60,
+                        stream=True
+                    ) as result_response:
+                        if result_response.ok:
+                            for line in result_response.iter_lines():
+                                if line:
+                                    line_str = line.decode('utf-8')
+                                    if line_str.startswith('data:'):
+                                        data = json.loads(line_str[5:].strip())
+                                        if isinstance(data, list) and len(data) > 0:
+                                            result = data[0] if isinstance(data[0], dict) else {}
+                                            if result.get("status") == "success":
+                                                insights = result.get("insights", {})
+                                                return {
+                                                    "context": insights.get("full_response", ""),
+                                                    "domain": insights.get("domain", "general"),
+                                                    "recommendations": insights.get("recommendations", [])
+                                                }
         except Exception as e:
             print(f"[{self.PERSONA_NAME}] Fine-tuned query error: {e}")
         
@@ -797,6 +800,11 @@ Use the provided context to ensure accuracy.
         return md
 
 
+# Shared agent for the convenience function; its setup is invariant for the
+# lifetime of the process, so build it on first use and reuse it afterwards
+_default_agent: Optional[UserStoryAgent] = None
+
+
 # Convenience function
 def create_user_stories(user_query: str) -> UserStoryResponse:
     """
@@ -808,8 +816,10 @@ def create_user_stories(user_query: str) -> UserStoryResponse:
     Returns:
         UserStoryResponse with structured stories
     """
-    agent = UserStoryAgent()
-    return agent.transform_to_user_stories(user_query)
+    global _default_agent
+    if _default_agent is None:
+        _default_agent = UserStoryAgent()
+    return _default_agent.transform_to_user_stories(user_query)
 
 
 if __name__ == "__main__":
@@ -49,6 +49,11 @@ config = Config()
 # LLM API Configuration
 LLM_API_URL = os.getenv("LLM_API_URL", "https://your-modal-app--llm-inference-api-fastapi-app.modal.run")
 
+# Shared HTTP session so repeated calls to the MCP server and Modal APIs
+# reuse keep-alive connections instead of a fresh TCP+TLS handshake each time
+session = requests.Session()
+session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
 class WorkflowState:
     def __init__(self):
         self.workflow_running = False
@@ -106,7 +111,7 @@ def call_mcp_rag(requirement: str) -> Dict:
     # Try MCP server first
     try:
         print(f"DEBUG: Calling RAG via MCP: {config.MCP_SERVER_URL}")
-        response = requests.post(
+        response = session.post(
             f"{config.MCP_SERVER_URL}{config.API_ENDPOINT_RAG}",
             json={"data": [requirement]},
             timeout=60
@@ -116,21 +121,22 @@ def call_mcp_rag(requirement: str) -> Dict:
             event_data = response.json()
             event_id = event_data.get("event_id")
             if event_id:
-                result_response = requests.get(
+                with session.get(
                     f"{config.MCP_SERVER_URL}{config.API_ENDPOINT_RAG}/{event_id}",
-                    timeout=60
-                )
-                if result_response.ok:
-                    for line in result_response.iter_lines():
-                        if line:
-                            line_str = line.decode('utf-8')
-                            if line_str.startswith('data:'):
-                                data = json.loads(line_str[5:].strip())
-                                if isinstance(data, list) and len(data) > 0:
-                                    result = data[0] if isinstance(data[0], dict) else {}
-                                    if result.get("status") == "success":
-                                        print(f"DEBUG: MCP RAG success")
-                                        return result
+                    timeout=60,
+                    stream=True
+                ) as result_response:
+                    if result_response.ok:
+                        for line in result_response.iter_lines():
+                            if line:
+                                line_str = line.decode('utf-8')
+                                if line_str.startswith('data:'):
+                                    data = json.loads(line_str[5:].strip())
+                                    if isinstance(data, list) and len(data) > 0:
+                                        result = data[0] if isinstance(data[0], dict) else {}
+                                        if result.get("status") == "success":
+                                            print(f"DEBUG: MCP RAG success")
+                                            return result
         print(f"DEBUG: MCP RAG failed, trying direct API")
     except Exception as e:
         print(f"DEBUG: MCP RAG error: {e}")
@@ -140,7 +146,7 @@ def call_mcp_rag(requirement: str) -> Dict:
     
     try:
         print(f"DEBUG: Calling RAG API directly: {rag_api_url}")
-        response = requests.post(
+        response = session.post(
             f"{rag_api_url}/query",
             json={"question": requirement, "top_k": 3, "max_tokens": 256},
             timeout=30
@@ -202,7 +208,7 @@ def call_mcp_finetuned(requirement: str, domain: str = "general") -> Dict:
     # Try MCP server first
     try:
         print(f"DEBUG: Calling fine-tuned model via MCP: {config.MCP_SERVER_URL}")
-        response = requests.post(
+        response = session.post(
             f"{config.MCP_SERVER_URL}{config.API_ENDPOINT_FINETUNED}",
             json={"data": [requirement, domain]},
             timeout=60
@@ -212,21 +218,22 @@ def call_mcp_finetuned(requirement: str, domain: str = "general") -> Dict:
             event_data = response.json()
             event_id = event_data.get("event_id")
             if event_id:
-                result_response = requests.get(
+                with session.get(
                     f"{config.MCP_SERVER_URL}{config.API_ENDPOINT_FINETUNED}/{event_id}",
-                    timeout=60
-                )
-                if result_response.ok:
-                    for line in result_response.iter_lines():
-                        if line:
-                            line_str = line.decode('utf-8')
-                            if line_str.startswith('data:'):
-                                data = json.loads(line_str[5:].strip())
-                                if isinstance(data, list) and len(data) > 0:
-                                    result = data[0] if isinstance(data[0], dict) else {}
-                                    if result.get("status") == "success":
-                                        print(f"DEBUG: MCP Fine-tuned success")
-                                        return result
+                    timeout=60,
+                    stream=True
+                ) as result_response:
+                    if result_response.ok:
+                        for line in result_response.iter_lines():
+                            if line:
+                                line_str = line.decode('utf-8')
+                                if line_str.startswith('data:'):
+                                    data = json.loads(line_str[5:].strip())
+                                    if isinstance(data, list) and len(data) > 0:
+                                        result = data[0] if isinstance(data[0], dict) else {}
+                                        if result.get("status") == "success":
+                                            print(f"DEBUG: MCP Fine-tuned success")
+                                            return result
         print(f"DEBUG: MCP Fine-tuned failed, trying direct API")
     except Exception as e:
         print(f"DEBUG: MCP Fine-tuned error: {e}")
@@ -236,7 +243,7 @@ def call_mcp_finetuned(requirement: str, domain: str = "general") -> Dict:
     
     try:
         print(f"DEBUG: Calling fine-tuned API directly: {ft_api_url}")
-        response = requests.post(
+        response = session.post(
             f"{ft_api_url}/ask",
             json={"question": requirement, "context": f"Domain: {domain}"},
             timeout=10
@@ -272,7 +279,7 @@ def call_mcp_search_epics(keywords: str, threshold: float = 0.6) -> Dict:
     try:
         print(f"DEBUG: Searching epics via MCP: {config.MCP_SERVER_URL}")
         # Gradio 4.x API format
-        response = requests.post(
+        response = session.post(
             f"{config.MCP_SERVER_URL}{config.API_ENDPOINT_SEARCH_EPICS}",
             json={"data": [keywords, threshold]},
             timeout=30
@@ -283,18 +290,19 @@ def call_mcp_search_epics(keywords: str, threshold: float = 0.6) -> Dict:
             event_data = response.json()
             event_id = event_data.get("event_id")
             if event_id:
-                result_response = requests.get(
+                with session.get(
                     f"{config.MCP_SERVER_URL}{config.API_ENDPOINT_SEARCH_EPICS}/{event_id}",
-                    timeout=30
-                )
-                if result_response.ok:
-                    for line in result_response.iter_lines():
-                        if line:
-                            line_str = line.decode('utf-8')
-                            if line_str.startswith('data:'):
-                                data = json.loads(line_str[5:].strip())
-                                if isinstance(data, list) and len(data) > 0:
-                                    return data[0] if isinstance(data[0], dict) else {"status": "success", "epics": [], "count": 0}
+                    timeout=30,
+                    stream=True
+                ) as result_response:
+                    if result_response.ok:
+                        for line in result_response.iter_lines():
+                            if line:
+                                line_str = line.decode('utf-8')
+                                if line_str.startswith('data:'):
+                                    data = json.loads(line_str[5:].strip())
+                                    if isinstance(data, list) and len(data) > 0:
+                                        return data[0] if isinstance(data[0], dict) else {"status": "success", "epics": [], "count": 0}
         print(f"DEBUG: MCP search failed, returning empty")
     except Exception as e:
         print(f"DEBUG: MCP search error: {e}")
@@ -305,7 +313,7 @@ def call_mcp_create_epic(summary: str, description: str, project_key: str = "SCR
     """Create JIRA epic via MCP server"""
     try:
         print(f"DEBUG: Creating epic via MCP: {config.MCP_SERVER_URL}")
-        response = requests.post(
+        response = session.post(
             f"{config.MCP_SERVER_URL}{config.API_ENDPOINT_CREATE_EPIC}",
             json={"data": [summary, description, project_key]},
             timeout=30
@@ -315,21 +323,22 @@ def call_mcp_create_epic(summary: str, description: str, project_key: str = "SCR
             event_data = response.json()
             event_id = event_data.get("event_id")
             if event_id:
-                result_response = requests.get(
+                with session.get(
                     f"{config.MCP_SERVER_URL}{config.API_ENDPOINT_CREATE_EPIC}/{event_id}",
-                    timeout=30
-                )
-                if result_response.ok:
-                    for line in result_response.iter_lines():
-                        if line:
-                            line_str = line.decode('utf-8')
-                            if line_str.startswith('data:'):
-                                data = json.loads(line_str[5:].strip())
-                                if isinstance(data, list) and len(data) > 0:
-                                    result = data[0] if isinstance(data[0], dict) else {}
-                                    if result.get("status") == "success":
-                                        print(f"DEBUG: Epic created: {result.get('epic', {}).get('key')}")
-                                        return result
+                    timeout=30,
+                    stream=True
+                ) as result_response:
+                    if result_response.ok:
+                        for line in result_response.iter_lines():
+                            if line:
+                                line_str = line.decode('utf-8')
+                                if line_str.startswith('data:'):
+                                    data = json.loads(line_str[5:].strip())
+                                    if isinstance(data, list) and len(data) > 0:
+                                        result = data[0] if isinstance(data[0], dict) else {}
+                                        if result.get("status") == "success":
+                                            print(f"DEBUG: Epic created: {result.get('epic', {}).get('key')}")
+                                            return result
         print(f"DEBUG: MCP create epic failed")
     except Exception as e:
         print(f"DEBUG: MCP create epic error: {e}")
@@ -348,7 +357,7 @@ def call_mcp_create_user_story(epic_key: str, summary: str, description: str, st
     """Create JIRA user story via MCP server"""
     try:
         print(f"DEBUG: Creating story via MCP: {config.MCP_SERVER_URL}")
-        response = requests.post(
+        response = session.post(
             f"{config.MCP_SERVER_URL}{config.API_ENDPOINT_CREATE_STORY}",
             json={"data": [epic_key, summary, description, story_points or 3]},
             timeout=30
@@ -358,21 +367,22 @@ def call_mcp_create_user_story(epic_key: str, summary: str, description: str, st
             event_data = response.json()
             event_id = event_data.get("event_id")
             if event_id:
-                result_response = requests.get(
+                with session.get(
                     f"{config.MCP_SERVER_URL}{config.API_ENDPOINT_CREATE_STORY}/{event_id}",
-                    timeout=30
-                )
-                if result_response.ok:
-                    for line in result_response.iter_lines():
-                        if line:
-                            line_str = line.decode('utf-8')
-                            if line_str.startswith('data:'):
-                                data = json.loads(line_str[5:].strip())
-                                if isinstance(data, list) and len(data) > 0:
-                                    result = data[0] if isinstance(data[0], dict) else {}
-                                    if result.get("status") == "success":
-                                        print(f"DEBUG: Story created: {result.get('story', {}).get('key')}")
-                                        return result
+                    timeout=30,
+                    stream=True
+                ) as result_response:
+                    if result_response.ok:
+                        for line in result_response.iter_lines():
+                            if line:
+                                line_str = line.decode('utf-8')
+                                if line_str.startswith('data:'):
+                                    data = json.loads(line_str[5:].strip())
+                                    if isinstance(data, list) and len(data) > 0:
+                                        result = data[0] if isinstance(data[0], dict) else {}
+                                        if result.get("status") == "success":
+                                            print(f"DEBUG: Story created: {result.get('story', {}).get('key')}")
+                                            return result
         print(f"DEBUG: MCP create story failed")
     except Exception as e:
         print(f"DEBUG: MCP create story error: {e}")
@@ -404,7 +414,7 @@ def call_llm_api(prompt: str, system_prompt: str = None, max_tokens: int = 256,
         if system_prompt:
             payload["system_prompt"] = system_prompt
         
-        response = requests.post(
+        response = session.post(
             f"{LLM_API_URL}/generate",
             json=payload,
             timeout=90  # Increased for cold starts
@@ -520,7 +530,7 @@ def estimate_complexity(requirement: str) -> Dict:
 def call_llm_chat(message: str, system_prompt: str = "You are a helpful AI assistant.", max_tokens: int = 256) -> Dict:
     """Call the LLM API chat endpoint"""
     try:
-        response = requests.post(
+        response = session.post(
             f"{LLM_API_URL}/chat",
             json={
                 "message": message,
@@ -691,7 +701,7 @@ Provide a structured analysis."""
         }
         
         try:
-            response = requests.post(
+            response = session.post(
                 f"{fm_api_url}/ask",
                 json={"question": analysis_prompt, "context": "Software requirement analysis"},
                 timeout=15
@@ -1313,7 +1323,7 @@ async def llm_chat(req: LLMChatRequest):
 async def llm_health():
     """Check LLM API health"""
     try:
-        response = requests.get(f"{LLM_API_URL}/health", timeout=10)
+        response = session.get(f"{LLM_API_URL}/health", timeout=10)
         if response.ok:
             return {"status": "healthy", "llm_api": response.json()}
         return {"status": "unhealthy", "error": f"Status {response.status_code}"}
@@ -4,6 +4,7 @@ import json
 from datetime import datetime
 import os
 from difflib import SequenceMatcher
+import requests
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -32,6 +33,11 @@ class Config:
 
 config = Config()
 
+# Shared HTTP session: RAG, fine-tuned model and JIRA calls reuse pooled
+# keep-alive connections instead of paying DNS + TLS setup on every tool call
+session = requests.Session()
+session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
 # ===== Mock Data Storage =====
 mock_epics = [
     {
@@ -82,8 +88,6 @@ def query_rag(requirement: str, rag_source: str = "auto") -> Dict:
     
     if config.RAG_ENABLED and config.RAG_API_URL:
         try:
-            import requests
-            
             # Use /retrieve endpoint for dual RAG
             api_url = config.RAG_API_URL.rstrip('/')
             if not api_url.endswith('/retrieve'):
@@ -91,7 +95,7 @@ def query_rag(requirement: str, rag_source: str = "auto") -> Dict:
             
             print(f"[RAG] Calling dual RAG endpoint: {api_url}")
             
-            response = requests.post(
+            response = session.post(
                 api_url,
                 json={
                     "question": requirement, 
@@ -218,7 +222,6 @@ def query_finetuned_model(requirement: str, domain: str = "general") -> Dict:
     
     if config.FINETUNED_MODEL_API_URL:
         try:
-            import requests
             print(f"[Fine-tuning] Calling remote endpoint: {config.FINETUNED_MODEL_API_URL}")
             
             # Map inputs to the API expected format
@@ -227,7 +230,7 @@ def query_finetuned_model(requirement: str, domain: str = "general") -> Dict:
                 "context": f"Domain: {domain}. Provide specific insights for this domain."
             }
             
-            response = requests.post(
+            response = session.post(
                 config.FINETUNED_MODEL_API_URL,
                 json=payload,
                 headers={"Content-Type": "application/json"},
@@ -319,7 +322,6 @@ def search_jira_epics(keywords: str, similarity_threshold: float = 0.6) -> Dict:
     if use_real_jira():
         try:
             # Use direct REST API call to avoid deprecated GET endpoint
-            import requests
             from requests.auth import HTTPBasicAuth
             
             jql = f'project = "{config.JIRA_PROJECT_KEY}" AND issuetype = Epic AND (summary ~ "{keywords}" OR description ~ "{keywords}")'
@@ -344,7 +346,7 @@ def search_jira_epics(keywords: str, similarity_threshold: float = 0.6) -> Dict:
             }
             
             print(f"[JIRA] POST to {api_url}")
-            response = requests.post(api_url, json=payload, headers=headers, auth=auth)
+            response = session.post(api_url, json=payload, headers=headers, auth=auth)
             
             # If standard search fails with 410, try the specific endpoint mentioned in error
             if response.status_code == 410:
@@ -355,7 +357,7 @@ def search_jira_epics(keywords: str, similarity_threshold: float = 0.6) -> Dict:
                 # Actually, strictly following the error message recommendation.
                 # Documentation says POST /rest/api/3/search/jql takes { "jql": "...", ... } just like search
                 print(f"[JIRA] POST to {api_url}")
-                response = requests.post(api_url, json=payload, headers=headers, auth=auth)
+                response = session.post(api_url, json=payload, headers=headers, auth=auth)
                 
             if not response.ok:
                 print(f"[JIRA] Error response: {response.text}")
@@ -593,7 +595,6 @@ def get_available_epics() -> List[str]:
     if use_real_jira():
         try:
             # Use direct REST API call to avoid deprecated GET endpoint
-            import requests
             from requests.auth import HTTPBasicAuth
             
             # Ensure no trailing slash in base URL
@@ -615,12 +616,12 @@ def get_available_epics() -> List[str]:
                 "fields": ["summary"]
             }
             
-            response = requests.post(api_url, json=payload, headers=headers, auth=auth)
+            response = session.post(api_url, json=payload, headers=headers, auth=auth)
             
             # Handle 410 fallback
             if response.status_code == 410:
                 api_url = f"{base_url}/rest/api/3/search/jql"
-                response = requests.post(api_url, json=payload, headers=headers, auth=auth)
+                response = session.post(api_url, json=payload, headers=headers, auth=auth)
                 
             if response.ok:
                 data = response.json()
@@ -24,6 +24,9 @@ image = (
     volumes={"/data/checkpoints": vol_checkpoints},
     scaledown_window=300,
 )
+# Let concurrent requests share one container so vLLM's scheduler can batch
+# them on the GPU instead of each request running alone at batch size 1
+@modal.concurrent(max_inputs=64)
 class Model:
     @modal.enter()
     def load_model(self):
@@ -49,6 +52,9 @@ class Model:
             gpu_memory_utilization=0.90,
             enforce_eager=False,
             trust_remote_code=True,
+            # Continuous batching: admit up to 64 sequences per scheduler step
+            max_num_seqs=64,
+            max_num_batched_tokens=4096,
         )
         
         # Manually set disable_log_requests on the engine args object if needed, 
@@ -71,19 +77,15 @@ class Model:
             stop=["<|end|>"]
         )
 
-    @modal.fastapi_endpoint(method="POST")
-    async def ask(self, data: dict):
+    def _build_prompt(self, question: str, context: str) -> str:
+        # Phi-3 Chat Format. Tokenized whole by the engine: splicing separately
+        # tokenized pieces adds SentencePiece "▁" prefixes the model never saw
+        return f"<|user|>\n{question}\n\nContext:\n{context}<|end|>\n<|assistant|>"
+
+    async def _generate(self, question: str, context: str) -> str:
         import uuid
-        import time
-        
-        start_time = time.time()
-        
-        question = data.get('question', '')
-        context = data.get('context', 'Context: Japan Census data.')
-        
-        # Phi-3 Chat Format
-        prompt = f"<|user|>\n{question}\n\nContext:\n{context}<|end|>\n<|assistant|>"
         
+        prompt = self._build_prompt(question, context)
         request_id = str(uuid.uuid4())
         results_generator = self.engine.generate(prompt, self.sampling_params, request_id)
         
@@ -92,11 +94,19 @@ class Model:
         async for request_output in results_generator:
             final_output = request_output
             
-        text_output = final_output.outputs[0].text.strip()
+        # vLLM returns only the generated continuation, never the prompt
+        return final_output.outputs[0].text.strip()
+
+    @modal.fastapi_endpoint(method="POST")
+    async def ask(self, data: dict):
+        import time
         
-        # Clean up response
-        # Clean up response (vLLM usually returns just the generated part, but we check)
-        answer = text_output.replace(prompt, "").strip()
+        start_time = time.time()
+        
+        question = data.get('question', '')
+        context = data.get('context', 'Context: Japan Census data.')
+        
+        answer = await self._generate(question, context)
             
         latency = time.time() - start_time
         
@@ -105,3 +115,54 @@ class Model:
             "latency_ms": round(latency * 1000, 2),
             "model": "phi-3-mini-ft-vllm"
         }
+
+    @modal.fastapi_endpoint(method="POST")
+    async def ask_batch(self, data: dict):
+        import asyncio
+        import time
+        
+        start_time = time.time()
+        
+        questions = data.get('questions', [])
+        context = data.get('context', 'Context: Japan Census data.')
+        
+        # Submit every question to the engine at once; vLLM batches them
+        answers = await asyncio.gather(*(self._generate(q, context) for q in questions))
+        
+        latency = time.time() - start_time
+        
+        return {
+            "answers": list(answers),
+            "latency_ms": round(latency * 1000, 2),
+            "model": "phi-3-mini-ft-vllm"
+        }
+
+    @modal.fastapi_endpoint(method="POST")
+    async def ask_stream(self, data: dict):
+        import json
+        import uuid
+        from fastapi.responses import StreamingResponse
+        
+        question = data.get('question', '')
+        context = data.get('context', 'Context: Japan Census data.')
+        
+        prompt = self._build_prompt(question, context)
+        request_id = str(uuid.uuid4())
+        
+        async def event_stream():
+            sent = 0
+            finished = False
+            try:
+                async for request_output in self.engine.generate(prompt, self.sampling_params, request_id):
+                    text = request_output.outputs[0].text
+                    if len(text) > sent:
+                        yield f"data: {json.dumps({'delta': text[sent:]}, ensure_ascii=False)}\n\n"
+                        sent = len(text)
+                    finished = request_output.finished
+                yield "data: [DONE]\n\n"
+            finally:
+                # Client went away mid-generation: free the sequence's GPU slot
+                if not finished:
+                    await self.engine.abort(request_id)
+        
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
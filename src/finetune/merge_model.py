@@ -41,6 +41,7 @@ def merge_model():
         "microsoft/Phi-3-mini-4k-instruct",
         torch_dtype=torch.bfloat16,
         device_map="auto",
+        low_cpu_mem_usage=True,
         trust_remote_code=True,
     )
     
@@ -1,6 +1,8 @@
+import functools
 import modal
 import os
 import random
+import re
 
 app = modal.App("prepare-finetune-data-parallel")
 
@@ -9,7 +11,33 @@ vol_census = modal.Volume.from_name("census-data")
 vol_economy = modal.Volume.from_name("economy-labor-data")
 vol_dataset = modal.Volume.from_name("finetune-dataset", create_if_missing=True)
 
-image = modal.Image.debian_slim().pip_install("pandas", "openpyxl")
+# Rows per chunk when streaming a CSV through process_file
+CSV_CHUNK_ROWS = 50_000
+# Lines read up front for header detection (both strategies need <= 20 rows)
+HEAD_PROBE_LINES = 64
+# Upper bound on files per process_files.map batch in main()
+MAX_BATCH_FILES = 1000
+# Files handed to each process_files call, amortizing per-call overhead
+FILES_PER_CALL = 10
+# Files at least this large get a newline count and row sampling up front;
+# smaller ones are parsed in a single pass
+ROW_SAMPLING_MIN_BYTES = 8 << 20
+
+# Value cleaning patterns: leading codes like "13103_" and numpy type wrappers
+_CODE_RE = re.compile(r'^\d+_')
+_NP_RE = re.compile(r'^np\.(?:int|float)\d*\((.+)\)$')
+
+@functools.lru_cache(maxsize=131072)
+def clean_text(val_str: str):
+    """Clean and normalize a non-null value's string form (cached per container)"""
+    val_str = val_str.strip()
+    # Remove leading codes like "13103_"
+    val_str = _CODE_RE.sub('', val_str)
+    # Remove numpy type wrappers
+    val_str = _NP_RE.sub(r'\1', val_str)
+    return val_str if val_str and val_str.lower() not in ['nan', 'none', ''] else None
+
+image = modal.Image.debian_slim().pip_install("pandas", "pyarrow", "openpyxl", "orjson")
 
 @app.function(
     image=image,
@@ -18,38 +46,56 @@ image = modal.Image.debian_slim().pip_install("pandas", "openpyxl")
         "/data/economy": vol_economy
     }
 )
-def list_csv_files() -> list:
-    """Lists all CSV files in both volumes."""
-    files = []
-    
-    # Census
-    for root, _, filenames in os.walk("/data/census"):
-        for f in filenames:
-            if f.lower().endswith('.csv'):
-                files.append({"path": os.path.join(root, f), "source": "Japan Census"})
-                
-    # Economy
-    for root, _, filenames in os.walk("/data/economy"):
-        for f in filenames:
-            if f.lower().endswith('.csv'):
-                files.append({"path": os.path.join(root, f), "source": "Japan Economy & Labor"})
-                
-    return files
+def list_subtree(root: str) -> list:
+    """Lists all CSV files under one directory of a volume."""
+    # Explicit os.scandir recursion reuses the dirent type instead of a stat per entry
+    paths = []
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith('.csv'):
+                    paths.append(entry.path)
+    return paths
 
 @app.function(
     image=image,
     volumes={
         "/data/census": vol_census,
         "/data/economy": vol_economy
-    },
-    timeout=1200,  # 20 minutes for complex files
-    max_containers=100
+    }
 )
-def process_file(file_info: dict) -> list:
-    """Process a single CSV file with robust parsing logic."""
+def list_csv_files() -> list:
+    """Lists all CSV files in both volumes."""
+    sources = {"/data/census": "Japan Census", "/data/economy": "Japan Economy & Labor"}
+    files = []
+    subtrees = []
+    
+    # Top-level files are listed here; each top-level directory is scanned
+    # in its own container so large mounts are walked in parallel
+    for root, source in sources.items():
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subtrees.append((entry.path, source))
+                elif entry.name.lower().endswith('.csv'):
+                    files.append({"path": entry.path, "source": source})
+    
+    subtree_paths = list_subtree.map([path for path, _ in subtrees])
+    for (_, source), paths in zip(subtrees, subtree_paths):
+        files.extend({"path": path, "source": source} for path in paths)
+                
+    return files
+
+def process_file(file_info: dict) -> tuple:
+    """Process a single CSV file into (train, val) lists of serialized JSONL Q/A entries."""
+    import io
+    import itertools
+    import numpy as np
+    import orjson
     import pandas as pd
-    import re
-    import random
     
     file_path = file_info["path"]
     source_name = file_info["source"]
@@ -59,12 +105,20 @@ def process_file(file_info: dict) -> list:
         """Clean and normalize values"""
         if pd.isna(val):
             return None
-        val_str = str(val).strip()
-        # Remove leading codes like "13103_"
-        val_str = re.sub(r'^\d+_', '', val_str)
-        # Remove numpy type wrappers
-        val_str = re.sub(r'^np\.(int|float)\d*\((.+)\)$', r'\2', val_str)
-        return val_str if val_str and val_str.lower() not in ['nan', 'none', ''] else None
+        return clean_text(str(val))
+    
+    def clean_series(series):
+        """Vectorized clean_value over a whole column"""
+        # Arrow-backed strings run strip/regex in pyarrow compute kernels; pass
+        # the pattern strings since compiled patterns fall back to Python
+        cleaned = (
+            series.astype("string[pyarrow]")
+            .str.strip()
+            .str.replace(_CODE_RE.pattern, '', regex=True)
+            .str.replace(_NP_RE.pattern, r'\1', regex=True)
+        )
+        empty = cleaned.isna() | cleaned.str.lower().isin(['nan', 'none', ''])
+        return cleaned.astype(object).where(~empty, None)
     
     try:
         # Extract title from filename
@@ -73,13 +127,26 @@ def process_file(file_info: dict) -> list:
         parts = filename_no_ext.split('_', 1)
         title = parts[1].replace('_', ' ') if len(parts) > 1 else filename_no_ext
         
+        # Both header strategies only inspect the first rows; read those lines
+        # from the volume once and parse each probe from memory
+        with open(file_path, 'rb') as f:
+            head_bytes = b''.join(itertools.islice(f, HEAD_PROBE_LINES))
+        
+        # Without a comma every row is a single column, which can never yield
+        # a label/value pair; HTML/XML saved as .csv is equally hopeless
+        head_start = head_bytes.lstrip(b'\xef\xbb\xbf \t\r\n')[:16].lower()
+        if b',' not in head_bytes or head_start.startswith((b'<!doctype', b'<html', b'<?xml')):
+            return [], []
+        
         # Strategy 1: Try Cross-Tabulation Parsing (Row 7 + Row 9 headers)
         # This is common in census data
+        headers = None
+        skiprows = 0
         try:
-            df_headers = pd.read_csv(file_path, header=None, nrows=15, low_memory=False)
+            df_headers = pd.read_csv(io.BytesIO(head_bytes), header=None, nrows=15, low_memory=False)
             
-            # Check if Row 7 and Row 9 look like headers
-            if len(df_headers) >= 10:
+            # Check if Row 7 and Row 9 look like headers (and data follows them)
+            if len(df_headers) > 10:
                 row7 = df_headers.iloc[7]
                 row9 = df_headers.iloc[9]
                 
@@ -96,30 +163,27 @@ def process_file(file_info: dict) -> list:
                         val = clean_value(row7[i])
                         headers.append(f"Dest_{val}" if val else f"Col_{i}")
                     
-                    # Read data skipping metadata
-                    df = pd.read_csv(file_path, header=None, skiprows=10, low_memory=False)
-                    
-                    # Adjust header length
-                    if len(df.columns) < len(headers):
-                        headers = headers[:len(df.columns)]
-                    else:
-                        headers += [f"Extra_{i}" for i in range(len(headers), len(df.columns))]
-                    
-                    df.columns = headers
+                    # Data starts after the metadata block
+                    skiprows = 10
         except:
-            df = None
+            headers = None
 
         # Strategy 2: Fallback to Smart Header Detection if Strategy 1 failed
-        if df is None or df.empty:
-            df_raw = pd.read_csv(file_path, header=None, low_memory=False)
+        if headers is None:
+            # Keep blank lines as empty rows so a row index is also the file line
+            # number that skiprows counts; they never pass the non-null check
+            df_raw = pd.read_csv(io.BytesIO(head_bytes), header=None, skip_blank_lines=False, low_memory=False)
             
-            # Find header row
+            # Find header row among the first 20 non-blank rows
             header_row_idx = None
-            data_start_idx = 0
+            rows_seen = 0
             
-            for i in range(min(20, len(df_raw))):
+            for i in range(len(df_raw)):
                 row = df_raw.iloc[i]
                 non_null_count = row.count()
+                if non_null_count:
+                    rows_seen += 1
+                    if rows_seen > 20: break
                 if non_null_count < len(df_raw.columns) * 0.3: continue
                 
                 # Skip if too many Unnamed
@@ -130,81 +194,130 @@ def process_file(file_info: dict) -> list:
                 header_like = sum(1 for val in row if pd.notna(val) and not str(val).replace('.','').isdigit())
                 if header_like >= non_null_count * 0.5:
                     header_row_idx = i
-                    data_start_idx = i + 1
                     break
             
             if header_row_idx is not None:
                 headers = df_raw.iloc[header_row_idx].tolist()
-                df = df_raw.iloc[data_start_idx:].reset_index(drop=True)
-                df.columns = headers
+                skiprows = header_row_idx + 1
             else:
-                return []
+                return [], []
 
-        # Common Cleaning Steps
-        
-        # Deduplicate headers
-        unique_headers = []
-        seen_headers = {}
-        for h in df.columns:
-            h_clean = clean_value(h) or "Unknown"
-            if h_clean in seen_headers:
-                seen_headers[h_clean] += 1
-                unique_headers.append(f"{h_clean}_{seen_headers[h_clean]}")
-            else:
-                seen_headers[h_clean] = 0
-                unique_headers.append(h_clean)
-        df.columns = unique_headers
+        # Stream the data rows in chunks so peak memory is bounded by the chunk
+        # size rather than the file. Each chunk is cleaned on its own and a
+        # uniform sample of rows is kept by retaining the smallest random keys.
+        sample_rows = 200
+        key_rng = np.random.default_rng(42)
+        valid_cols = None
+        df_sample = None
         
-        # Filter valid columns
-        valid_cols = [c for c in df.columns if "Unknown" not in c and "Unnamed" not in c]
-        if len(valid_cols) < 2: return []
-        df = df[valid_cols]
+        # For large files, pick candidate rows up front from a newline count and
+        # let the parser skip everything else. Oversample so rows that turn out
+        # empty after cleaning still leave a full sample.
+        row_filter = skiprows
+        if os.path.getsize(file_path) >= ROW_SAMPLING_MIN_BYTES:
+            with open(file_path, 'rb') as f:
+                line_count = sum(buf.count(b'\n') for buf in iter(lambda: f.read(1 << 20), b''))
+            if line_count - skiprows > CSV_CHUNK_ROWS:
+                picked_rows = set(random.Random(42).sample(range(skiprows, line_count), sample_rows * 2))
+                row_filter = lambda i: i not in picked_rows
         
-        # Clean values
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                df[col] = df[col].apply(clean_value)
+        for chunk in pd.read_csv(file_path, header=None, skiprows=row_filter, chunksize=CSV_CHUNK_ROWS, low_memory=False):
+            if valid_cols is None:
+                # Adjust header length
+                if len(chunk.columns) < len(headers):
+                    headers = headers[:len(chunk.columns)]
+                else:
+                    headers += [f"Extra_{i}" for i in range(len(headers), len(chunk.columns))]
+                
+                # Deduplicate headers: the nth repeat of a name gets an "_n" suffix
+                cleaned_headers = pd.Series([clean_value(h) or "Unknown" for h in headers])
+                repeat = cleaned_headers.groupby(cleaned_headers, sort=False).cumcount()
+                suffix = ("_" + repeat.astype(str)).where(repeat > 0, "")
+                headers = (cleaned_headers + suffix).tolist()
+                
+                # Filter valid columns
+                valid_cols = [c for c in headers if "Unknown" not in c and "Unnamed" not in c]
+                if len(valid_cols) < 2: return [], []
+            
+            chunk.columns = headers
+            chunk = chunk[valid_cols]
+            
+            # Clean values (one vectorized pass per text column)
+            for col in chunk.select_dtypes(include=['object', 'string']).columns:
+                chunk[col] = clean_series(chunk[col])
+            
+            chunk = chunk.dropna(how='all')
+            if len(chunk) == 0: continue
+            
+            keys = pd.Series(key_rng.random(len(chunk)), index=chunk.index)
+            if df_sample is not None:
+                chunk = pd.concat([df_sample, chunk])
+                keys = pd.concat([sample_keys, keys])
+            keep = np.argsort(keys.to_numpy(), kind='stable')[:sample_rows]
+            df_sample = chunk.iloc[keep]
+            sample_keys = keys.iloc[keep]
         
-        df = df.dropna(how='all')
-        if len(df) == 0: return []
+        if df_sample is None: return [], []
+        df = df_sample
 
-        # Generate QA Pairs
-        # Sample 200 rows per file
-        sample_rows = 200
-        if len(df) > sample_rows:
-            df_sample = df.sample(sample_rows, random_state=42)
-        else:
-            df_sample = df
-        
+        # Generate QA Pairs from the sampled rows
         label_col = df.columns[0] # Assume first column is the label (Area Name)
         value_cols = df.columns[1:]
         
-        for _, row in df_sample.iterrows():
-            row_label = row[label_col]
-            if not row_label: continue
+        labels = df_sample[label_col].to_numpy(dtype=object)
+        values = df_sample[value_cols].to_numpy(dtype=object)
+        value_names = np.asarray(value_cols, dtype=object)
+        row_idx = np.arange(len(labels))
+        has_label = pd.notna(labels) & (labels != '')
+        rng = np.random.default_rng()
+        context = f"Context: {source_name} data."
+        
+        # Create 3 QA pairs per row: each round draws one random value column
+        # for every sampled row at once instead of walking rows with iterrows
+        for _ in range(3):
+            col_idx = rng.integers(0, len(value_names), size=len(labels))
+            picked = values[row_idx, col_idx]
+            keep = has_label & pd.notna(picked) & (picked != '')
             
-            # Create 3 QA pairs per row
-            for _ in range(3):
-                if len(value_cols) == 0: break
-                col = random.choice(value_cols)
-                val = row[col]
-                
-                if not val: continue
-                
+            for row_label, col, val in zip(labels[keep], value_names[col_idx[keep]], picked[keep]):
                 question = f"What is the {col} for {row_label} in the '{title}' dataset?"
                 answer = f"According to '{title}', the {col} for {row_label} is {val}."
                 
                 entry = {
                     "instruction": question,
-                    "input": f"Context: {source_name} data.",
+                    "input": context,
                     "output": answer
                 }
-                data_points.append(entry)
+                # Serialize in the worker so save_batch only joins bytes
+                data_points.append(orjson.dumps(entry))
                         
     except Exception as e:
         pass
     
-    return data_points
+    # Split 90/10 here so main() only concatenates worker results
+    is_train = np.random.default_rng().random(len(data_points)) < 0.9
+    train_points = [p for p, t in zip(data_points, is_train) if t]
+    val_points = [p for p, t in zip(data_points, is_train) if not t]
+    return train_points, val_points
+
+@app.function(
+    image=image,
+    volumes={
+        "/data/census": vol_census,
+        "/data/economy": vol_economy
+    },
+    timeout=3600,  # 1 hour for a group of complex files
+    max_containers=100
+)
+def process_files(file_infos: list) -> tuple:
+    """Process a group of CSV files in one call, concatenating their (train, val) entries."""
+    train_points = []
+    val_points = []
+    for file_info in file_infos:
+        file_train, file_val = process_file(file_info)
+        train_points.extend(file_train)
+        val_points.extend(file_val)
+    return train_points, val_points
 
 @app.local_entrypoint()
 def main():
@@ -214,10 +327,14 @@ def main():
     files = list_csv_files.remote()
     print(f"Found {len(files)} files. Starting parallel processing...")
     
-    # Process in batches
-    batch_size = 1000
+    # Process in evenly sized batches of at most MAX_BATCH_FILES, so the last
+    # batch isn't a thin remainder that leaves most containers idle
+    num_batches = max(1, -(-len(files) // MAX_BATCH_FILES))
+    batch_size = max(1, -(-len(files) // num_batches))
     total_train = 0
     total_val = 0
+    pending_save = None
+    first_save = True
     
     for batch_start in range(0, len(files), batch_size):
         batch_end = min(batch_start + batch_size, len(files))
@@ -225,28 +342,32 @@ def main():
         
         print(f"Processing batch {batch_start//batch_size + 1}/{(len(files)-1)//batch_size + 1} ({len(batch_files)} files)...")
         
-        batch_data = []
-        for result in process_file.map(batch_files):
-            batch_data.extend(result)
+        train_batch = []
+        val_batch = []
+        file_groups = [batch_files[i:i + FILES_PER_CALL] for i in range(0, len(batch_files), FILES_PER_CALL)]
+        for train_points, val_points in process_files.map(file_groups, order_outputs=False):
+            train_batch.extend(train_points)
+            val_batch.extend(val_points)
         
-        print(f"Batch generated {len(batch_data)} data points")
+        print(f"Batch generated {len(train_batch) + len(val_batch)} data points")
         
-        if not batch_data:
+        if not train_batch and not val_batch:
             continue
         
-        # Shuffle and split
-        random.shuffle(batch_data)
-        split_idx = int(len(batch_data) * 0.9)
-        train_batch = batch_data[:split_idx]
-        val_batch = batch_data[split_idx:]
-        
-        # Save
-        save_batch.remote(train_batch, val_batch, batch_start == 0)
+        # Save in the background while the next batch is processed; wait for
+        # the previous save first so appends land in batch order
+        if pending_save is not None:
+            pending_save.get()
+        pending_save = save_batch.spawn(train_batch, val_batch, first_save)
+        first_save = False
         
         total_train += len(train_batch)
         total_val += len(val_batch)
         
-        print(f"Saved {len(train_batch)} train, {len(val_batch)} val. Total: {total_train} train, {total_val} val")
+        print(f"Queued {len(train_batch)} train, {len(val_batch)} val. Total: {total_train} train, {total_val} val")
+    
+    if pending_save is not None:
+        pending_save.get()
     
     print(f"✅ Done! Total: {total_train} train, {total_val} val")
 
@@ -256,18 +377,12 @@ def main():
     timeout=600
 )
 def save_batch(train_data, val_data, is_first_batch):
-    import json
-    
-    mode = 'w' if is_first_batch else 'a'
-    
-    with open("/data/dataset/train.jsonl", mode, encoding='utf-8') as f:
-        for entry in train_data:
-            json.dump(entry, f, ensure_ascii=False)
-            f.write('\n')
+    mode = 'wb' if is_first_batch else 'ab'
     
-    with open("/data/dataset/val.jsonl", mode, encoding='utf-8') as f:
-        for entry in val_data:
-            json.dump(entry, f, ensure_ascii=False)
-            f.write('\n')
+    # Entries arrive as serialized JSON lines; issue a single write per file
+    for path, entries in (("/data/dataset/train.jsonl", train_data), ("/data/dataset/val.jsonl", val_data)):
+        payload = b''.join(line + b'\n' for line in entries)
+        with open(path, mode, buffering=1 << 20) as f:
+            f.write(payload)
     
     vol_dataset.commit()
@@ -3,6 +3,7 @@ Dual RAG Query API - Queries both existing_products and product_design collectio
 Returns merged context from both sources for User Story Agent to use
 """
 
+import functools
 import modal
 
 app = modal.App("insurance-rag-dual-query")
@@ -15,7 +16,7 @@ image = (
     .pip_install(
         "torch>=2.0.0", "transformers>=4.30.0", "sentence-transformers>=2.2.0",
         "huggingface_hub>=0.15.0", "langchain-community>=0.0.13",
-        "chromadb>=0.4.0", "fastapi>=0.100.0", "uvicorn[standard]>=0.20.0",
+        "chromadb>=0.6.0", "fastapi>=0.100.0", "uvicorn[standard]>=0.20.0",
     )
 )
 
@@ -31,18 +32,35 @@ class DualRAGRetriever:
     def enter(self):
         from langchain_community.embeddings import HuggingFaceEmbeddings
         import chromadb
+        import numpy as np
         
         self.embeddings = HuggingFaceEmbeddings(
             model_name=EMBEDDING_MODEL, 
             model_kwargs={'device': 'cpu'}, 
             encode_kwargs={'normalize_embeddings': True}
         )
+        # Per-instance cache so "both" lookups and repeated questions embed only once
+        self._embed_query = functools.lru_cache(maxsize=1024)(self._compute_query_embedding)
         self.chroma_client = chromadb.PersistentClient(path="/insurance-data/chroma_db")
+        # Collections are small, so load each one into memory once and search it
+        # with a single matrix product instead of a Chroma query per request.
+        # Rows and queries are unit-normalized here ('langchain' is written
+        # outside this repo), so the inner product is cosine similarity
         self.collections = {}
         for name in ['existing_products', 'product_design', 'langchain']:
             try: 
-                self.collections[name] = self.chroma_client.get_collection(name)
-                print(f"Connected to {name}: {self.collections[name].count()} docs")
+                data = self.chroma_client.get_collection(name).get(
+                    include=["embeddings", "documents", "metadatas"]
+                )
+                embeddings = np.asarray(data["embeddings"], dtype=np.float32)
+                if len(embeddings):
+                    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+                self.collections[name] = {
+                    "embeddings": embeddings,
+                    "documents": data["documents"],
+                    "metadatas": data["metadatas"],
+                }
+                print(f"Connected to {name}: {len(data['documents'])} docs")
             except Exception as e: 
                 print(f"Collection {name} not found: {e}")
     
@@ -56,25 +74,34 @@ class DualRAGRetriever:
             return "design"
         return "both"
     
+    def _compute_query_embedding(self, question: str) -> tuple:
+        # Tuple so values held by the _embed_query cache can't be mutated
+        import numpy as np
+        
+        embedding = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        return tuple(embedding / max(np.linalg.norm(embedding), 1e-12))
+    
     def _query_collection(self, name, question, top_k=3):
         if name not in self.collections: 
             return []
-        query_embedding = self.embeddings.embed_query(question)
-        results = self.collections[name].query(
-            query_embeddings=[query_embedding], 
-            n_results=top_k
-        )
+        import numpy as np
+        
+        collection = self.collections[name]
+        if not collection["documents"]:
+            return []
+        query_embedding = np.asarray(self._embed_query(question), dtype=np.float32)
+        scores = collection["embeddings"] @ query_embedding
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
         docs = []
-        if results and results.get('documents') and results['documents']:
-            for i, doc_text in enumerate(results['documents'][0]):
-                meta = {}
-                if results.get('metadatas') and results['metadatas'][0]:
-                    meta = results['metadatas'][0][i]
-                meta['collection'] = name
-                docs.append({
-                    "content": doc_text[:800],
-                    "metadata": meta
-                })
+        for i in top:
+            meta = dict(collection["metadatas"][i] or {})
+            meta['collection'] = name
+            docs.append({
+                "content": collection["documents"][i][:800],
+                "metadata": meta
+            })
         return docs
     
     @modal.method()
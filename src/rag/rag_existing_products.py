@@ -19,6 +19,13 @@ vol = modal.Volume.from_name("mcp-hack-ins-products", create_if_missing=True)
 # Model configuration
 EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
 
+# CPUs reserved for the document loader; its worker pool is sized to match
+# (os.cpu_count() reports the host's cores, not the container's reservation)
+LOADER_CPUS = 8
+
+# Pages per PDF extraction task, so long PDFs are split across workers
+PDF_PAGES_PER_TASK = 20
+
 # Source folders to index
 SOURCE_FOLDERS = [
     "/insurance-data/aig",
@@ -40,10 +47,11 @@ image = (
         "langchain-text-splitters>=0.2.0",
         "langchain-core>=0.1.0",
         "langchain-huggingface>=0.0.3",
-        "chromadb>=0.4.0",
+        "chromadb>=0.6.0",
         "pdfminer.six>=20231228",  # Better Japanese text extraction
         "cryptography>=3.1",  # For AES-encrypted PDFs
     )
+    .add_local_python_source("rag_indexing")
 )
 
 
@@ -70,17 +78,46 @@ def list_existing_product_files():
     return all_files
 
 
-@app.function(image=image, volumes={"/insurance-data": vol}, timeout=600)
-def load_existing_products():
-    """Load all existing insurance product PDFs using pdfminer for proper Japanese text"""
+def count_pdf_pages(full_path: str) -> int:
+    """Count pages without extracting text (0 if the PDF can't be parsed)"""
+    from pdfminer.pdfpage import PDFPage
+    
+    try:
+        with open(full_path, 'rb') as f:
+            return sum(1 for _ in PDFPage.get_pages(f))
+    except Exception:
+        return 0
+
+
+def extract_pdf_pages(full_path: str, page_numbers):
+    """Extract text from a range of PDF pages; returns (text or None, error or None)"""
     import os
     from pdfminer.high_level import extract_text
     from pdfminer.pdfparser import PDFSyntaxError
     
+    file = os.path.basename(full_path)
+    
+    try:
+        # Use pdfminer.six for proper Japanese text extraction
+        return extract_text(full_path, page_numbers=page_numbers), None
+    except PDFSyntaxError as e:
+        return None, f"  ❌ PDF syntax error {file}: {e}"
+    except Exception as e:
+        return None, f"  ❌ Error loading {file}: {e}"
+
+
+@app.function(image=image, volumes={"/insurance-data": vol}, timeout=600, cpu=LOADER_CPUS)
+def load_existing_products():
+    """Load all existing insurance product PDFs using pdfminer for proper Japanese text"""
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    
     documents = []
     
     print("📚 Loading existing insurance product PDFs (with Japanese support)...")
     
+    pdf_paths = []
+    companies = []
     for folder in SOURCE_FOLDERS:
         if not os.path.exists(folder):
             print(f"  ⚠️ Skipping non-existent folder: {folder}")
@@ -88,45 +125,71 @@ def load_existing_products():
             
         # Extract company name from folder
         company = os.path.basename(folder)
-        print(f"\n📁 Processing {company}/")
+        folder_pdfs = [f for f in os.listdir(folder) if f.endswith('.pdf')]
+        print(f"📁 {company}/: {len(folder_pdfs)} PDFs")
+        
+        for file in folder_pdfs:
+            pdf_paths.append(os.path.join(folder, file))
+            companies.append(company)
+    
+    # pdfminer is pure Python and CPU-bound. Split every PDF into page ranges
+    # so one long PDF is spread over all workers instead of pinning one core;
+    # map keeps results in input order.
+    print(f"\n⚙️ Extracting {len(pdf_paths)} PDFs with {LOADER_CPUS} workers...")
+    with ProcessPoolExecutor(max_workers=LOADER_CPUS) as executor:
+        page_counts = list(executor.map(count_pdf_pages, pdf_paths))
         
-        for file in os.listdir(folder):
-            if not file.endswith('.pdf'):
+        task_paths = []
+        task_pages = []
+        for full_path, page_count in zip(pdf_paths, page_counts):
+            if page_count == 0:
+                # Unparseable page tree: extract whole so the error is reported
+                task_paths.append(full_path)
+                task_pages.append(None)
                 continue
-                
-            full_path = os.path.join(folder, file)
-            
-            try:
-                # Use pdfminer.six for proper Japanese text extraction
-                full_text = extract_text(full_path)
-                
-                if not full_text or not full_text.strip():
-                    print(f"  ⚠️ No text extracted: {file}")
-                    continue
-                
-                # Check if text contains valid Japanese or English
-                has_valid_text = any(ord(c) > 127 or c.isalpha() for c in full_text[:1000])
-                if not has_valid_text:
-                    print(f"  ⚠️ No valid text found: {file}")
-                    continue
-                
-                documents.append({
-                    'page_content': full_text,
-                    'metadata': {
-                        'source': full_path,
-                        'filename': file,
-                        'company': company,
-                        'type': 'existing_product',
-                        'format': 'pdf',
-                        'language': 'ja'  # Mark as Japanese
-                    }
-                })
-                print(f"  ✅ {file} ({len(full_text):,} chars)")
-                
-            except PDFSyntaxError as e:
-                print(f"  ❌ PDF syntax error {file}: {e}")
-            except Exception as e:
-                print(f"  ❌ Error loading {file}: {e}")
+            for start in range(0, page_count, PDF_PAGES_PER_TASK):
+                task_paths.append(full_path)
+                task_pages.append(list(range(start, min(start + PDF_PAGES_PER_TASK, page_count))))
+        
+        pdf_texts = {full_path: [] for full_path in pdf_paths}
+        pdf_errors = {}
+        for full_path, (text, error) in zip(task_paths, executor.map(extract_pdf_pages, task_paths, task_pages)):
+            if error:
+                pdf_errors.setdefault(full_path, error)
+            else:
+                pdf_texts[full_path].append(text)
+    
+    for full_path, company in zip(pdf_paths, companies):
+        file = os.path.basename(full_path)
+        
+        if full_path in pdf_errors:
+            print(pdf_errors[full_path])
+            continue
+        
+        full_text = ''.join(pdf_texts[full_path])
+        
+        if not full_text or not full_text.strip():
+            print(f"  ⚠️ No text extracted: {file}")
+            continue
+        
+        # Check if text contains valid Japanese or English
+        has_valid_text = any(ord(c) > 127 or c.isalpha() for c in full_text[:1000])
+        if not has_valid_text:
+            print(f"  ⚠️ No valid text found: {file}")
+            continue
+        
+        documents.append({
+            'page_content': full_text,
+            'metadata': {
+                'source': full_path,
+                'filename': file,
+                'company': company,
+                'type': 'existing_product',
+                'format': 'pdf',
+                'language': 'ja'  # Mark as Japanese
+            }
+        })
+        print(f"  ✅ {company}/{file} ({len(full_text):,} chars)")
     
     print(f"\n✅ Loaded {len(documents)} documents total")
     return documents
@@ -140,10 +203,10 @@ def load_existing_products():
 )
 def index_existing_products():
     """Create vector index for existing insurance products"""
-    from langchain_huggingface import HuggingFaceEmbeddings
     from langchain_text_splitters import RecursiveCharacterTextSplitter
     from langchain_core.documents import Document
     import chromadb
+    from rag_indexing import embed_and_store
     
     print("🚀 Indexing existing insurance products...")
     
@@ -173,18 +236,6 @@ def index_existing_products():
     chunks = text_splitter.split_documents(langchain_docs)
     print(f"📦 Created {len(chunks)} chunks")
     
-    # Create embeddings
-    print("\n🧠 Creating embeddings...")
-    import torch
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    print(f"   Using device: {device}")
-    
-    embeddings = HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL,
-        model_kwargs={'device': device},
-        encode_kwargs={'normalize_embeddings': True}
-    )
-    
     # Store in ChromaDB
     print("\n💾 Storing in ChromaDB (existing_products collection)...")
     chroma_client = chromadb.PersistentClient(path="/insurance-data/chroma_db")
@@ -201,23 +252,7 @@ def index_existing_products():
         metadata={"description": "Existing insurance product PDFs from various companies"}
     )
     
-    # Generate embeddings and upsert
-    batch_size = 50
-    for i in range(0, len(chunks), batch_size):
-        batch = chunks[i:i+batch_size]
-        
-        ids = [f"existing_{i+j}" for j in range(len(batch))]
-        documents_text = [chunk.page_content for chunk in batch]
-        metadatas = [chunk.metadata for chunk in batch]
-        embeddings_list = embeddings.embed_documents(documents_text)
-        
-        collection.add(
-            ids=ids,
-            documents=documents_text,
-            embeddings=embeddings_list,
-            metadatas=metadatas
-        )
-        print(f"   Batch {i//batch_size + 1}/{(len(chunks)-1)//batch_size + 1} complete")
+    embed_and_store(chunks, collection, EMBEDDING_MODEL, id_prefix="existing")
     
     # Commit to volume
     vol.commit()
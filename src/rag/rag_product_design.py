@@ -19,6 +19,10 @@ vol = modal.Volume.from_name("mcp-hack-ins-products", create_if_missing=True)
 # Model configuration
 EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
 
+# CPUs reserved for the document loader; its worker pool is sized to match
+# (os.cpu_count() reports the host's cores, not the container's reservation)
+LOADER_CPUS = 8
+
 # Source folders to index
 SOURCE_FOLDERS = [
     "/insurance-data/docs",
@@ -38,15 +42,36 @@ image = (
         "langchain-text-splitters>=0.2.0",
         "langchain-core>=0.1.0",
         "langchain-huggingface>=0.0.3",  # New HuggingFace integration
-        "chromadb>=0.4.0",
+        "chromadb>=0.6.0",
         "python-docx>=1.1.0",
+        "lxml>=4.9.0",  # streamed document.xml parsing
         "openpyxl>=3.1.0",
-        "pandas>=2.0.0",
+        "pandas>=2.2.0",  # engine="calamine" support
+        "python-calamine>=0.2.0",  # Rust Excel reader for .xls and .xlsx
         "xlrd>=2.0.0",
     )
+    .add_local_python_source("rag_indexing")
 )
 
 
+def scan_design_files() -> dict:
+    """Map each existing source folder to its supported files in one scandir pass"""
+    import os
+    
+    found = {}
+    for folder in SOURCE_FOLDERS:
+        try:
+            with os.scandir(folder) as entries:
+                # is_file() uses the cached dirent type, so no extra stat per entry
+                found[folder] = sorted(
+                    entry.path for entry in entries
+                    if entry.is_file() and entry.name.endswith(('.docx', '.xlsx', '.xls'))
+                )
+        except FileNotFoundError:
+            continue
+    return found
+
+
 @app.function(image=image, volumes={"/insurance-data": vol})
 def list_product_design_files():
     """List all product design files"""
@@ -54,15 +79,14 @@ def list_product_design_files():
     
     print("🔍 Scanning product design folders...")
     all_files = []
+    found = scan_design_files()
     
     for folder in SOURCE_FOLDERS:
-        if os.path.exists(folder):
+        if folder in found:
             print(f"\n📁 {folder}:")
-            for file in os.listdir(folder):
-                if file.endswith(('.docx', '.xlsx', '.xls')):
-                    full_path = os.path.join(folder, file)
-                    all_files.append(full_path)
-                    print(f"  📄 {file}")
+            for full_path in found[folder]:
+                all_files.append(full_path)
+                print(f"  📄 {os.path.basename(full_path)}")
         else:
             print(f"  ⚠️ Folder not found: {folder}")
     
@@ -70,84 +94,190 @@ def list_product_design_files():
     return all_files
 
 
-@app.function(image=image, volumes={"/insurance-data": vol}, timeout=600)
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def read_docx_text(full_path: str) -> str:
+    """Body paragraphs, then table rows joined with ' | ', streamed from document.xml
+
+    Gives the same text as python-docx's doc.paragraphs / row.cells without
+    building a Python object for every paragraph, row and cell.
+    """
+    import zipfile
+    from lxml import etree
+    
+    def run_text(r):
+        parts = []
+        for child in r:
+            if child.tag == W_NS + "t":
+                parts.append(child.text or "")
+            elif child.tag in (W_NS + "tab", W_NS + "ptab"):
+                parts.append("\t")
+            elif child.tag == W_NS + "br":
+                # Page and column breaks carry no text
+                if child.get(W_NS + "type", "textWrapping") == "textWrapping":
+                    parts.append("\n")
+            elif child.tag == W_NS + "cr":
+                parts.append("\n")
+            elif child.tag == W_NS + "noBreakHyphen":
+                parts.append("-")
+        return "".join(parts)
+    
+    def paragraph_text(p):
+        parts = []
+        for child in p:
+            if child.tag == W_NS + "r":
+                parts.append(run_text(child))
+            elif child.tag == W_NS + "hyperlink":
+                parts.extend(run_text(r) for r in child.iterchildren(W_NS + "r"))
+        return "".join(parts)
+    
+    paragraphs = []
+    rows = []
+    with zipfile.ZipFile(full_path) as zf, zf.open("word/document.xml") as xml:
+        for _, elem in etree.iterparse(xml, events=("end",), tag=(W_NS + "p", W_NS + "tbl")):
+            parent = elem.getparent()
+            # Paragraphs inside tables are read with their table
+            if parent is None or parent.tag != W_NS + "body":
+                continue
+            
+            if elem.tag == W_NS + "p":
+                text = paragraph_text(elem)
+                if text.strip():
+                    paragraphs.append(text)
+            else:
+                # Text per grid column, so vertically merged cells repeat the
+                # cell above and spanned cells repeat once per column
+                above = {}
+                for tr in elem.iterchildren(W_NS + "tr"):
+                    cells = []
+                    for tc in tr.iterchildren(W_NS + "tc"):
+                        span = tc.find(f"{W_NS}tcPr/{W_NS}gridSpan")
+                        span = int(span.get(W_NS + "val")) if span is not None else 1
+                        vmerge = tc.find(f"{W_NS}tcPr/{W_NS}vMerge")
+                        col = len(cells)
+                        if vmerge is not None and vmerge.get(W_NS + "val", "continue") == "continue":
+                            text = above.get(col, "")
+                        else:
+                            text = "\n".join(paragraph_text(p) for p in tc.iterchildren(W_NS + "p"))
+                        for c in range(col, col + span):
+                            above[c] = text
+                        cells.extend([text] * span)
+                    row_text = ' | '.join(cells)
+                    if row_text.strip():
+                        rows.append(row_text)
+            
+            # Drop what has been read so memory stays flat on large documents
+            elem.clear()
+            while elem.getprevious() is not None:
+                del parent[0]
+    
+    return '\n'.join(paragraphs + rows)
+
+
+def read_docx_text_python_docx(full_path: str) -> str:
+    """Fallback for read_docx_text that goes through python-docx's object model"""
+    import docx
+    
+    doc = docx.Document(full_path)
+    text_content = [para.text for para in doc.paragraphs if para.text.strip()]
+    for table in doc.tables:
+        for row in table.rows:
+            row_text = ' | '.join([cell.text for cell in row.cells])
+            if row_text.strip():
+                text_content.append(row_text)
+    return '\n'.join(text_content)
+
+
+def extract_design_document(full_path: str):
+    """Extract one DOCX/Excel file; returns (document or None, log line or None)"""
+    import os
+    import pandas as pd
+    
+    file = os.path.basename(full_path)
+    
+    try:
+        if file.endswith('.docx'):
+            try:
+                full_text = read_docx_text(full_path)
+            except Exception as e:
+                print(f"  ⚠️ XML read failed for {file}, retrying with python-docx: {e}")
+                full_text = read_docx_text_python_docx(full_path)
+            doc_type = 'word'
+        
+        elif file.endswith(('.xlsx', '.xls')):
+            # Load Excel document (calamine parses both .xls and .xlsx
+            # several times faster than openpyxl/xlrd). na_filter=False
+            # keeps empty cells as '' so no NaN values are materialized
+            # and rendered into the indexed text.
+            read_kwargs = {"sheet_name": None, "na_filter": False}
+            try:
+                excel_data = pd.read_excel(full_path, engine="calamine", **read_kwargs)
+            except Exception as e:
+                print(f"  ⚠️ calamine failed for {file}, retrying with default engine: {e}")
+                excel_data = pd.read_excel(full_path, **read_kwargs)
+            text_content = []
+            
+            for sheet_name, df in excel_data.items():
+                # Drop rows that are entirely empty
+                df = df[~df.eq('').all(axis=1)]
+                text_content.append(f"Sheet: {sheet_name}")
+                # CSV skips to_string()'s column alignment padding, which was
+                # slow to build and bloated chunks with whitespace
+                text_content.append(df.to_csv(index=False))
+                text_content.append("")
+            
+            full_text = '\n'.join(text_content)
+            doc_type = 'excel'
+        
+        else:
+            return None, None
+        
+        if not full_text.strip():
+            return None, f"  ⚠️ No text extracted: {file}"
+        
+        document = {
+            'page_content': full_text,
+            'metadata': {
+                'source': full_path,
+                'filename': file,
+                'type': 'product_design',
+                'format': doc_type
+            }
+        }
+        return document, f"  ✅ {file} ({len(full_text):,} chars, {doc_type})"
+        
+    except Exception as e:
+        return None, f"  ❌ Error loading {file}: {e}"
+
+
+@app.function(image=image, volumes={"/insurance-data": vol}, timeout=600, cpu=LOADER_CPUS)
 def load_product_design_docs():
     """Load all product design documents (DOCX, XLSX)"""
     import os
-    import docx
-    import pandas as pd
+    from concurrent.futures import ProcessPoolExecutor
     
     documents = []
     
     print("📚 Loading product design documents...")
     
+    paths = []
+    found = scan_design_files()
     for folder in SOURCE_FOLDERS:
-        if not os.path.exists(folder):
+        if folder not in found:
             print(f"  ⚠️ Skipping non-existent folder: {folder}")
             continue
-            
-        print(f"\n📁 Processing {folder}/")
-        
-        for file in os.listdir(folder):
-            full_path = os.path.join(folder, file)
-            
-            # Skip directories
-            if os.path.isdir(full_path):
-                continue
-            
-            try:
-                if file.endswith('.docx'):
-                    # Load Word document
-                    doc = docx.Document(full_path)
-                    text_content = []
-                    
-                    for para in doc.paragraphs:
-                        if para.text.strip():
-                            text_content.append(para.text)
-                    
-                    # Extract tables
-                    for table in doc.tables:
-                        for row in table.rows:
-                            row_text = ' | '.join([cell.text for cell in row.cells])
-                            if row_text.strip():
-                                text_content.append(row_text)
-                    
-                    full_text = '\n'.join(text_content)
-                    doc_type = 'word'
-                    
-                elif file.endswith(('.xlsx', '.xls')):
-                    # Load Excel document
-                    excel_data = pd.read_excel(full_path, sheet_name=None)
-                    text_content = []
-                    
-                    for sheet_name, df in excel_data.items():
-                        text_content.append(f"Sheet: {sheet_name}")
-                        text_content.append(df.to_string())
-                        text_content.append("")
-                    
-                    full_text = '\n'.join(text_content)
-                    doc_type = 'excel'
-                    
-                else:
-                    continue
-                
-                if not full_text.strip():
-                    print(f"  ⚠️ No text extracted: {file}")
-                    continue
-                
-                documents.append({
-                    'page_content': full_text,
-                    'metadata': {
-                        'source': full_path,
-                        'filename': file,
-                        'type': 'product_design',
-                        'format': doc_type
-                    }
-                })
-                print(f"  ✅ {file} ({len(full_text):,} chars, {doc_type})")
-                
-            except Exception as e:
-                print(f"  ❌ Error loading {file}: {e}")
+        paths.extend(found[folder])
+    
+    # Parsing DOCX/Excel is CPU-bound Python, so load files in parallel
+    # worker processes; map keeps results in input order
+    print(f"⚙️ Loading {len(paths)} files with {LOADER_CPUS} workers...")
+    with ProcessPoolExecutor(max_workers=LOADER_CPUS) as executor:
+        for document, message in executor.map(extract_design_document, paths):
+            if message:
+                print(message)
+            if document is not None:
+                documents.append(document)
     
     print(f"\n✅ Loaded {len(documents)} documents total")
     return documents
@@ -161,10 +291,10 @@ def load_product_design_docs():
 )
 def index_product_design():
     """Create vector index for product design documents"""
-    from langchain_huggingface import HuggingFaceEmbeddings
     from langchain_text_splitters import RecursiveCharacterTextSplitter
     from langchain_core.documents import Document
     import chromadb
+    from rag_indexing import embed_and_store
     
     print("🚀 Indexing product design documents...")
     
@@ -194,18 +324,6 @@ def index_product_design():
     chunks = text_splitter.split_documents(langchain_docs)
     print(f"📦 Created {len(chunks)} chunks")
     
-    # Create embeddings
-    print("\n🧠 Creating embeddings...")
-    import torch
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    print(f"   Using device: {device}")
-    
-    embeddings = HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL,
-        model_kwargs={'device': device},
-        encode_kwargs={'normalize_embeddings': True}
-    )
-    
     # Store in ChromaDB
     print("\n💾 Storing in ChromaDB (product_design collection)...")
     chroma_client = chromadb.PersistentClient(path="/insurance-data/chroma_db")
@@ -222,23 +340,7 @@ def index_product_design():
         metadata={"description": "TokyoDrive product design specifications"}
     )
     
-    # Generate embeddings and upsert
-    batch_size = 50
-    for i in range(0, len(chunks), batch_size):
-        batch = chunks[i:i+batch_size]
-        
-        ids = [f"design_{i+j}" for j in range(len(batch))]
-        documents_text = [chunk.page_content for chunk in batch]
-        metadatas = [chunk.metadata for chunk in batch]
-        embeddings_list = embeddings.embed_documents(documents_text)
-        
-        collection.add(
-            ids=ids,
-            documents=documents_text,
-            embeddings=embeddings_list,
-            metadatas=metadatas
-        )
-        print(f"   Batch {i//batch_size + 1}/{(len(chunks)-1)//batch_size + 1} complete")
+    embed_and_store(chunks, collection, EMBEDDING_MODEL, id_prefix="design")
     
     # Commit to volume
     vol.commit()
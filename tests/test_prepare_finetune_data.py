@@ -0,0 +1,99 @@
+import json
+import os
+import random
+import re
+import sys
+
+import pytest
+
+pytest.importorskip("modal")
+pytest.importorskip("orjson")
+pytest.importorskip("pyarrow")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "finetune"))
+
+import prepare_finetune_data  # noqa: E402
+
+QUESTION_RE = re.compile(r"^What is the (.+) for (.+) in the '.+' dataset\?$")
+
+
+def run_process_file(csv_path):
+    train, val = prepare_finetune_data.process_file({"path": str(csv_path), "source": "Test"})
+    return train, val, [json.loads(point) for point in train + val]
+
+
+def asked(entries):
+    """(column, label) pairs parsed from the generated questions"""
+    return [QUESTION_RE.match(entry["instruction"]).groups() for entry in entries]
+
+
+def test_blank_line_above_header_is_not_read_as_data(tmp_path):
+    csv_path = tmp_path / "0001_ward_stats.csv"
+    rows = "".join(f"Ward{i},{i * 10},{i * 3},{i}\n" for i in range(1, 40))
+    csv_path.write_text("Title,,,\n\nArea,Population,Households,Companies\n" + rows)
+
+    _, _, entries = run_process_file(csv_path)
+
+    assert entries
+    assert all(" for Area " not in entry["output"] for entry in entries)
+    assert all(label.startswith("Ward") for _, label in asked(entries))
+
+
+def test_cross_tab_headers_come_from_rows_7_and_9(tmp_path):
+    csv_path = tmp_path / "0002_commuters.csv"
+    meta = ["Commuting destination table,,,,,"] + [",,,,,"] * 6
+    meta += [",,,,Tokyo,Osaka", ",,,,,", "Area,Code,Year,Unit,,"]
+    rows = [f"Ward{i},{i},2020,persons,{i * 10},{i * 20}" for i in range(1, 31)]
+    csv_path.write_text("\n".join(meta + rows) + "\n")
+
+    _, _, entries = run_process_file(csv_path)
+    pairs = asked(entries)
+
+    assert pairs
+    assert {col for col, _ in pairs} <= {"Code", "Year", "Unit", "Dest_Tokyo", "Dest_Osaka"}
+    assert any(col.startswith("Dest_") for col, _ in pairs)
+    assert all(label.startswith("Ward") for _, label in pairs)
+
+
+def test_duplicate_headers_get_numbered_suffixes(tmp_path):
+    csv_path = tmp_path / "0003_repeated.csv"
+    rows = "".join(f"Ward{i},{i},{i * 2},{i * 3}\n" for i in range(1, 61))
+    csv_path.write_text("Area,Value,Value,Value\n" + rows)
+
+    _, _, entries = run_process_file(csv_path)
+
+    assert {col for col, _ in asked(entries)} == {"Value", "Value_1", "Value_2"}
+
+
+def test_large_files_only_parse_the_picked_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(prepare_finetune_data, "ROW_SAMPLING_MIN_BYTES", 1)
+    monkeypatch.setattr(prepare_finetune_data, "CSV_CHUNK_ROWS", 100)
+    num_rows = 2000
+    csv_path = tmp_path / "0004_large.csv"
+    rows = "".join(f"Ward{i},{i},{i * 2}\n" for i in range(1, num_rows + 1))
+    csv_path.write_text("Area,Population,Households\n" + rows)
+
+    _, _, entries = run_process_file(csv_path)
+
+    # Same draw process_file makes: 2 x 200 candidate lines after the header
+    picked_rows = set(random.Random(42).sample(range(1, num_rows + 1), 400))
+    labels = {label for _, label in asked(entries)}
+    assert len(labels) == 200
+    assert all(int(label[len("Ward"):]) in picked_rows for label in labels)
+
+
+def test_sample_is_deterministic_and_split_is_roughly_90_10(tmp_path):
+    csv_path = tmp_path / "0005_sampled.csv"
+    rows = "".join(f"Ward{i},{i},{i * 2},{i * 3}\n" for i in range(1, 1001))
+    csv_path.write_text("Area,Population,Households,Companies\n" + rows)
+
+    train, val, entries = run_process_file(csv_path)
+    _, _, entries_again = run_process_file(csv_path)
+    labels = {label for _, label in asked(entries)}
+
+    # 200 sampled rows, 3 Q/A pairs each, from the same rows on every run
+    assert len(labels) == 200
+    assert labels == {label for _, label in asked(entries_again)}
+    assert len(entries) == 600
+    assert val
+    assert 0.8 < len(train) / len(entries) < 0.97
@@ -0,0 +1,46 @@
+import io
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("modal")
+docx = pytest.importorskip("docx")
+pytest.importorskip("lxml")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "rag"))
+
+import rag_product_design  # noqa: E402
+
+
+def build_docx():
+    doc = docx.Document()
+    doc.add_paragraph("TokyoDrive coverage")
+    run = doc.add_paragraph("Tiers: ").add_run("Basic")
+    run.add_break()
+    run.add_text("Premium\tPlus")
+
+    table = doc.add_table(rows=3, cols=3)
+    for i in range(3):
+        for j in range(3):
+            table.cell(i, j).text = f"r{i}c{j}"
+    table.cell(0, 0).merge(table.cell(0, 1))  # spans two grid columns
+    table.cell(1, 2).merge(table.cell(2, 2))  # vertically merged
+    table.cell(1, 0).add_paragraph("second line")
+
+    doc.add_paragraph("Read after the table, listed before its rows")
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer
+
+
+def test_xml_reader_matches_python_docx_with_merged_cells():
+    expected = rag_product_design.read_docx_text_python_docx(build_docx())
+    text = rag_product_design.read_docx_text(build_docx())
+
+    assert text == expected
+    assert text.startswith("TokyoDrive coverage\nTiers: Basic\nPremium\tPlus\nRead after the table")
+    # Spanned cells repeat per grid column, vertically merged ones per row
+    assert "r0c0\nr0c1 | r0c0\nr0c1 | r0c2" in text
+    assert text.endswith("r2c0 | r2c1 | r1c2\nr2c2")